@@ -1,71 +1,157 @@
+import io
+import threading
 import streamlit as st
+import numpy as np
 import pandas as pd
-import joblib
-import shap
-import matplotlib.pyplot as plt
-import xgboost
-import json
+import plotly.graph_objects as go
+
+from utils.model import get_batch_booster, get_fallback_tree_explainer, get_model, get_tree_predictor
 
 # ==========================================
-# 0. 环境配置与中文支持
+# 0. 页面设置
 # ==========================================
-plt.rcParams['font.sans-serif'] = ['SimHei', 'Arial Unicode MS', 'sans-serif']
-plt.rcParams['axes.unicode_minus'] = False
-
-# 页面设置
 st.set_page_config(page_title="MUMPP转SMPP风险预测", layout="wide")
 
 # ==========================================
-# 1. 加载模型 (增加鲁棒性)
+# 1. 加载模型 (共享缓存，见 utils/model.py)
 # ==========================================
-@st.cache_resource
-def load_model():
-    try:
-        # 使用 joblib 加载模型包
-        package = joblib.load('xgb_smpp_model.pkl')
-        # 兼容性检查：如果是字典格式则提取，否则直接返回
-        if isinstance(package, dict):
-            model = package['model']
-            feature_names = package['feature_names']
-        else:
-            model = package
-            feature_names = model.feature_names_in_.tolist()  # 尝试从 sklearn 包装器提取
-        return model, feature_names
-    except Exception as e:
-        st.error(f"模型加载失败: {e}")
-        return None, None
-
-model, feature_names = load_model()
-if model is None:
+booster, feature_names = get_model()
+if booster is None:
     st.error("❌ 未找到有效模型。请确保 'xgb_smpp_model.pkl' 文件在当前目录下。")
     st.stop()
 
+@st.cache_data
+def classify_features(names):
+    # 按特征名关键词预先分类，避免每次重跑都在循环中做字符串匹配
+    return [('sex' if 'SEX' in n.upper() else 'age' if 'AGE' in n.upper() else 'num') for n in names]
+
+@st.cache_resource
+def _fig_cache():
+    # 进程内复用同一个 Figure，避免每次点击都新建画布和坐标轴
+    # Matplotlib 非线程安全，多个会话共用时需持锁绘图
+    import matplotlib.pyplot as plt
+    from matplotlib import font_manager
+    # 中文字体只探测一次并固定为单一字体，避免每次绘图时逐个回退扫描字体缓存
+    available = {f.name for f in font_manager.fontManager.ttflist}
+    chosen = next((f for f in ['SimHei', 'Arial Unicode MS', 'DejaVu Sans'] if f in available), 'DejaVu Sans')
+    plt.rcParams['font.sans-serif'] = [chosen]
+    plt.rcParams['axes.unicode_minus'] = False
+    fig = plt.figure(figsize=(10, 6))
+    return fig, threading.Lock()
+
+# 每个不同的输入向量一张图：限制条目数，按最近最少使用淘汰
+@st.cache_data(max_entries=256)
+def render_waterfall(input_tuple: tuple, feature_names: tuple, max_display: int = 10) -> go.Figure:
+    # 以输入向量为键缓存瀑布图，相同输入重复点击时直接命中缓存
+    import xgboost
+    feature_names = list(feature_names)
+    # float32 连续内存，与模型阈值精度一致；单行数据无需多线程构建 DMatrix
+    X = np.ascontiguousarray([input_tuple], dtype=np.float32)
+    # 直接调用 XGBoost 原生 TreeSHAP (C++)，跳过 shap.Explainer 的分发与 masker 构建
+    dmat = xgboost.DMatrix(X, feature_names=feature_names, nthread=1)
+    contribs = booster.predict(dmat, pred_contribs=True)[0]
+    # 最后一列为基准值 (base value)
+    values, base_value = contribs[:-1], float(contribs[-1])
+
+    # 按贡献绝对值排序，超出 max_display 的特征合并为一项
+    order = np.argsort(-np.abs(values))
+    labels = [f"{feature_names[j]} = {X[0, j]:.2f}" for j in order]
+    deltas = [float(values[j]) for j in order]
+    if len(order) > max_display:
+        rest = order[max_display - 1:]
+        labels = labels[:max_display - 1] + [f"其余 {len(rest)} 个特征"]
+        deltas = deltas[:max_display - 1] + [float(values[rest].sum())]
+
+    # 与 shap 瀑布图一致：自下而上从 E[f(x)] 累加到 f(x)，最重要的特征在顶部
+    labels, deltas = labels[::-1], deltas[::-1]
+    fig = go.Figure(go.Waterfall(
+        orientation="h",
+        measure=["relative"] * len(deltas),
+        base=base_value,
+        x=deltas,
+        y=labels,
+        text=[f"{d:+.3f}" for d in deltas],
+        textposition="outside",
+        increasing={"marker": {"color": "#ff0051"}},
+        decreasing={"marker": {"color": "#008bfb"}},
+        connector={"line": {"color": "#cccccc"}},
+    ))
+    fig.update_layout(
+        title=f"f(x) = {base_value + float(values.sum()):.3f}  (E[f(x)] = {base_value:.3f})",
+        showlegend=False,
+        height=max(300, 40 * len(deltas) + 120),
+        margin={"l": 10, "r": 10, "t": 50, "b": 10},
+    )
+    return fig
+
+# 批量缓存为全进程共享：限制条目数与存活时间，避免每个上传过的文件常驻内存
+@st.cache_data(max_entries=8, ttl=3600)
+def score_batch(csv_bytes: bytes, feature_names: tuple):
+    # 以上传文件内容为键缓存：文件不变时，表单提交等重跑不再重复解析与计算
+    import xgboost
+    feature_names = list(feature_names)
+    # 只解析所需列并直接读为 float32，省去整表读取后的 astype 复制
+    batch_df = pd.read_csv(io.BytesIO(csv_bytes), usecols=feature_names, dtype=np.float32)
+    # 列顺序已与模型一致时跳过重排复制
+    if list(batch_df.columns) != feature_names:
+        batch_df = batch_df[feature_names]
+    if batch_df.empty:
+        return batch_df, None, None
+    X_batch = np.ascontiguousarray(batch_df.to_numpy())
+    # 整批一次调用：概率与 TreeSHAP 贡献度的开销在所有行之间摊销
+    probs = booster.inplace_predict(X_batch)
+    dmat = xgboost.DMatrix(X_batch, feature_names=feature_names)
+    contribs = get_batch_booster().predict(dmat, pred_contribs=True)
+    return batch_df, probs, contribs
+
+@st.cache_data(max_entries=8, ttl=3600)
+def render_beeswarm(csv_bytes: bytes, feature_names: tuple) -> bytes:
+    # 缓存渲染好的 PNG，同一文件重跑时不再持全局锁重绘
+    import shap
+    import matplotlib.pyplot as plt
+    batch_df, _, contribs = score_batch(csv_bytes, feature_names)
+    shap_values = shap.Explanation(
+        values=contribs[:, :-1],
+        base_values=contribs[:, -1],
+        data=batch_df.to_numpy(),
+        feature_names=list(feature_names),
+    )
+    fig, lock = _fig_cache()
+    buf = io.BytesIO()
+    with lock:
+        plt.figure(fig.number)
+        shap.plots.beeswarm(shap_values, max_display=10, show=False)
+        # beeswarm 不做布局且会缩小画布，需按内容裁切，否则 x 轴标签被截掉 (st.pyplot 默认同样如此)
+        fig.savefig(buf, format='png', dpi=96, bbox_inches='tight')
+        fig.clear()
+    return buf.getvalue()
+
 # ==========================================
 # 2. 侧边栏输入 (添加单位并优化数值格式)
 # ==========================================
 st.sidebar.header("📝 患者临床指标输入")
-input_data = {}
+# 按特征顺序直接写入 float32 行向量，省去 dict -> DataFrame -> 列重排的开销
+X = np.empty((1, len(feature_names)), dtype=np.float32)
 units = {}  # 可以自定义每个特征的单位，例如：units['AGE'] = '岁'，units['其他指标'] = 'mmol/L' 等
 # 示例：假设非SEX/AGE的指标单位为 'mmol/L'，可根据实际调整
 
-with st.sidebar:
-    for col in feature_names:
-        # 根据特征名关键词自动适配输入组件，并添加单位
+# 使用表单：修改输入不会触发重跑，点击提交后统一重跑一次
+with st.sidebar.form("inputs"):
+    for i, (col, kind) in enumerate(zip(feature_names, classify_features(tuple(feature_names)))):
+        # 根据特征类别自动适配输入组件，并添加单位
         label = col
-        if 'SEX' in col.upper():
+        if kind == 'sex':
             label += " (性别)"
-            input_data[col] = st.selectbox(label, [1, 2], format_func=lambda x: "男" if x == 1 else "女")
-        elif 'AGE' in col.upper():
+            X[0, i] = st.selectbox(label, [1, 2], format_func=lambda x: "男" if x == 1 else "女")
+        elif kind == 'age':
             label += " (岁)"
-            input_data[col] = st.number_input(label, min_value=1, max_value=120, value=50)
+            X[0, i] = st.number_input(label, min_value=1, max_value=120, value=50)
         else:
             # 假设其他指标的单位为 'mmol/L'，可根据实际修改
             unit = units.get(col, 'mmol/L')  # 默认单位
             label += f" ({unit})"
-            input_data[col] = st.number_input(label, value=0.0, format="%.2f")  # 保留2位小数
-
-# 转换为 DataFrame 并保持特征顺序
-input_df = pd.DataFrame([input_data])[feature_names]
+            X[0, i] = st.number_input(label, value=0.0, format="%.2f")  # 保留2位小数
+    submitted = st.form_submit_button("开始预测 (Predict)", type="primary")
 
 # ==========================================
 # 3. 主界面预测逻辑
@@ -76,9 +162,17 @@ col1, col2 = st.columns([1, 1.5])
 
 with col1:
     st.subheader("📊 预测概率")
-    if st.button("开始预测 (Predict)", type="primary"):
-        # 1. 计算概率
-        prediction_prob = model.predict_proba(input_df)[:, 1][0]
+    if submitted:
+        # 1. 计算概率 (Numba 编译的单行树遍历，无 DMatrix、无逐树 Python 调度)
+        # 输入与上次相同时直接复用结果；SHAP 瀑布图由 render_waterfall 的缓存负责
+        key = hash(tuple(X[0].tolist()))
+        if st.session_state.get('last_key') == key:
+            prediction_prob = st.session_state['last_result']
+        else:
+            predict_one = get_tree_predictor()
+            prediction_prob = float(predict_one(X[0]))
+            st.session_state['last_key'] = key
+            st.session_state['last_result'] = prediction_prob
         
         # 2. 显示仪表盘
         risk_level = "高风险 (High Risk)" if prediction_prob > 0.5 else "低风险 (Low Risk)"
@@ -96,17 +190,10 @@ with col1:
             st.subheader("🔍 归因分析 (SHAP Explanation)")
             try:
                 with st.spinner("计算特征贡献度中..."):
-                    # 使用 shap.Explainer 作为首选，兼容性更好
-                    explainer = shap.Explainer(model)
-                    shap_values = explainer(input_df)
-                    # 绘图
-                    fig, ax = plt.subplots(figsize=(10, 6))
-                    # 绘制瀑布图
-                    shap.plots.waterfall(shap_values[0], max_display=10, show=False)
-                    # 调整布局防止标签重叠
-                    plt.tight_layout()
-                    st.pyplot(fig)
-                    plt.clf()
+                    st.plotly_chart(
+                        render_waterfall(tuple(X[0].tolist()), tuple(feature_names)),
+                        width="stretch",
+                    )
                 
                 st.info("💡 解释：**红色**条形表示增加风险的因素，**蓝色**条形表示降低风险的因素。")
             
@@ -114,20 +201,45 @@ with col1:
                 st.warning(f"SHAP 绘图尝试中... (错误: {e})")
                 # Fallback: 手动处理 Booster 逻辑
                 try:
-                    booster = model.get_booster()
-                    booster.feature_names = feature_names
-                    explainer = shap.TreeExplainer(booster)
+                    # 延迟导入：shap / matplotlib 导入链很重，只有回退绘图才需要
+                    import shap
+                    import matplotlib.pyplot as plt
+                    # 仅在回退绘图时才构建 DataFrame
+                    input_df = pd.DataFrame(X, columns=feature_names)
+                    explainer = get_fallback_tree_explainer()
                     shap_values = explainer.shap_values(input_df)
                     
-                    fig, ax = plt.subplots(figsize=(10, 6))
-                    shap.summary_plot(shap_values, input_df, plot_type="bar", show=False)
-                    plt.tight_layout()
-                    st.pyplot(fig)
-                    plt.clf()
+                    fig, lock = _fig_cache()
+                    with lock:
+                        plt.figure(fig.number)
+                        # summary_plot 内部已调用 tight_layout，此处不再重复布局求解
+                        shap.summary_plot(shap_values, input_df, plot_type="bar", show=False)
+                        st.pyplot(fig, clear_figure=True)
                 except Exception as fallback_e:
                     st.error(f"SHAP 解释失败: {fallback_e}")
     else:
         st.info("👈 请在左侧输入临床数据，然后点击按钮获取预测结果。")
 
+# ==========================================
+# 5. 批量预测 (CSV 上传，向量化计算概率与 SHAP)
+# ==========================================
+st.markdown("---")
+st.subheader("📁 批量预测 (Batch CSV)")
+uploaded = st.file_uploader("上传包含上述临床指标列的 CSV 文件", type="csv")
+if uploaded is not None:
+    csv_bytes = uploaded.getvalue()
+    try:
+        with st.spinner("批量计算预测概率与特征贡献度中..."):
+            batch_df, probs, _ = score_batch(csv_bytes, tuple(feature_names))
+    except ValueError as e:
+        st.error(f"CSV 格式不符 (缺少特征列或含非数值): {e}")
+    else:
+        if batch_df.empty:
+            # 仅有表头时 pred_contribs 返回一维空数组，无法切片出各特征贡献
+            st.warning("CSV 中没有数据行，请检查文件内容。")
+        else:
+            st.dataframe(batch_df.assign(**{"SMPP 发生概率": probs}))
+            st.image(render_beeswarm(csv_bytes, tuple(feature_names)))
+
 st.markdown("---")
 st.caption("注：本系统基于机器学习模型生成预测，仅供辅助科研参考，不作为临床诊断唯一依据。")
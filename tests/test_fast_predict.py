@@ -0,0 +1,74 @@
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pytest
+
+from utils.fast_predict import extract_tree_arrays, predict_one
+
+MODEL_PATH = Path(__file__).resolve().parent.parent / 'xgb_smpp_model.pkl'
+
+
+# ==========================================
+# Numba 单行推理与 XGBoost 官方推理的一致性回归测试
+# ==========================================
+@pytest.fixture(scope='module')
+def booster():
+    # 与 utils/model.py 的加载逻辑一致，但不依赖 Streamlit 缓存
+    package = joblib.load(MODEL_PATH)
+    if isinstance(package, dict):
+        model, feature_names = package['model'], package['feature_names']
+    else:
+        model, feature_names = package, package.feature_names_in_.tolist()
+    booster = model.get_booster()
+    booster.feature_names = list(feature_names)
+    return booster
+
+
+@pytest.fixture(scope='module')
+def arrays(booster):
+    return extract_tree_arrays(booster, booster.feature_names)
+
+
+def assert_matches_xgboost(booster, arrays, X):
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    expected = booster.inplace_predict(X)
+    actual = np.array([predict_one(x, *arrays) for x in X])
+    np.testing.assert_allclose(actual, expected, rtol=0, atol=1e-6)
+
+
+def test_random_rows(booster, arrays):
+    df = booster.trees_to_dataframe()
+    splits = df[df['Feature'] != 'Leaf']
+    rng = np.random.default_rng(0)
+    # 在各特征阈值范围的两侧稍作外扩后均匀采样
+    X = np.empty((2000, booster.num_features()), dtype=np.float32)
+    for j, name in enumerate(booster.feature_names):
+        thr = splits.loc[splits['Feature'] == name, 'Split']
+        lo, hi = (thr.min(), thr.max()) if len(thr) else (0.0, 1.0)
+        pad = (hi - lo) * 0.2 + 1.0
+        X[:, j] = rng.uniform(lo - pad, hi + pad, size=len(X))
+    assert_matches_xgboost(booster, arrays, X)
+
+
+def test_rows_with_missing_values(booster, arrays):
+    rng = np.random.default_rng(1)
+    X = rng.uniform(0, 100, size=(500, booster.num_features())).astype(np.float32)
+    X[rng.random(X.shape) < 0.3] = np.nan
+    X[0] = np.nan  # 全缺失行只走 Missing 分支
+    assert_matches_xgboost(booster, arrays, X)
+
+
+def test_rows_on_split_thresholds(booster, arrays):
+    # 取值恰好等于阈值时应走右支 (x < thr 才走左支)，再加上阈值下方相邻的 float32
+    df = booster.trees_to_dataframe()
+    splits = df[df['Feature'] != 'Leaf']
+    fidx = {name: j for j, name in enumerate(booster.feature_names)}
+    rng = np.random.default_rng(2)
+    rows = []
+    for name, thr in zip(splits['Feature'], splits['Split'].astype(np.float32)):
+        for value in (thr, np.nextafter(thr, np.float32(-np.inf))):
+            row = rng.uniform(0, 100, size=booster.num_features()).astype(np.float32)
+            row[fidx[name]] = value
+            rows.append(row)
+    assert_matches_xgboost(booster, arrays, np.array(rows))
@@ -0,0 +1,60 @@
+import numpy as np
+from numba import njit
+
+# ==========================================
+# 单行 XGBoost 推理：Numba 编译的树遍历
+# ==========================================
+# fastmath 不开启 nnan/ninf，保证缺失值 (NaN) 判断不被优化掉
+_FASTMATH = {"nsz", "arcp", "contract", "afn", "reassoc"}
+
+
+def extract_tree_arrays(booster, feature_names):
+    # 把 booster 的树结构展开为连续的 NumPy 数组 (每个进程只需执行一次)
+    df = booster.trees_to_dataframe()
+    # 节点 ID (如 "3-7") -> 全局行号；剪枝后节点编号可能不连续，因此不直接用 Node 列
+    pos = {node_id: i for i, node_id in enumerate(df['ID'])}
+    fidx = {name: i for i, name in enumerate(feature_names)}
+    fidx.update({f"f{i}": i for i in range(len(feature_names))})  # 无特征名时的默认命名
+
+    is_leaf = (df['Feature'] == 'Leaf').to_numpy()
+    feat = np.array([-1 if leaf else fidx[f] for f, leaf in zip(df['Feature'], is_leaf)], dtype=np.int32)
+    thr = df['Split'].fillna(0.0).to_numpy(dtype=np.float32)
+    left = np.array([pos.get(n, -1) for n in df['Yes']], dtype=np.int32)
+    right = np.array([pos.get(n, -1) for n in df['No']], dtype=np.int32)
+    missing = np.array([pos.get(n, -1) for n in df['Missing']], dtype=np.int32)
+    # 叶子节点的 Gain 列即叶子值
+    val = np.where(is_leaf, df['Gain'].to_numpy(), 0.0).astype(np.float32)
+
+    tree = df['Tree'].to_numpy()
+    starts = np.flatnonzero(np.r_[True, tree[1:] != tree[:-1]])
+    starts = np.append(starts, len(df)).astype(np.int32)
+
+    # base_score 等偏置不在树里：用全零样本对齐 XGBoost 的 margin 输出
+    x0 = np.zeros((1, len(feature_names)), dtype=np.float32)
+    margin0 = float(booster.inplace_predict(x0, predict_type='margin')[0])
+    bias = np.float64(margin0 - _margin(x0[0], feat, thr, left, right, missing, val, starts))
+    return feat, thr, left, right, missing, val, starts, bias
+
+
+@njit(cache=True, fastmath=_FASTMATH)
+def _margin(x, feat, thr, left, right, missing, val, starts):
+    acc = 0.0
+    for t in range(starts.shape[0] - 1):
+        n = starts[t]
+        while feat[n] >= 0:
+            v = x[feat[n]]
+            if np.isnan(v):
+                n = missing[n]
+            elif v < thr[n]:
+                n = left[n]
+            else:
+                n = right[n]
+        acc += val[n]
+    return acc
+
+
+@njit(cache=True, fastmath=_FASTMATH)
+def predict_one(x, feat, thr, left, right, missing, val, starts, bias):
+    # 返回单个样本的 P(y=1)，等价于 binary:logistic 下的 predict_proba(x)[:, 1]
+    acc = bias + _margin(x, feat, thr, left, right, missing, val, starts)
+    return 1.0 / (1.0 + np.exp(-acc))
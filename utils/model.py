@@ -0,0 +1,83 @@
+import json
+
+import numpy as np
+import streamlit as st
+
+# ==========================================
+# 模型与解释器的共享加载入口
+# ==========================================
+# st.cache_resource 按函数对象去重：所有页面都调用这里的函数，
+# 进程内只保留一份模型、一份解释器与一份 JIT 预测器
+
+MODEL_PATH = 'xgb_smpp_model.pkl'
+
+
+def get_model(path=MODEL_PATH):
+    # st.cache_resource 以实际传入的参数为键 (不补全默认值)，
+    # get_model() 与 get_model(path) 会各加载一次；统一按位置传参给缓存函数
+    return _load_model(path)
+
+
+@st.cache_resource
+def _load_model(path):
+    try:
+        # 延迟导入，仅在首次加载模型时付出导入开销
+        import joblib
+        # 使用 joblib 加载模型包
+        package = joblib.load(path)
+        # 兼容性检查：如果是字典格式则提取，否则直接返回
+        if isinstance(package, dict):
+            model = package['model']
+            feature_names = package['feature_names']
+        else:
+            model = package
+            feature_names = model.feature_names_in_.tolist()  # 尝试从 sklearn 包装器提取
+        # 下游只用到底层 Booster，特征名在此统一设置
+        booster = model.get_booster()
+        booster.feature_names = list(feature_names)
+        return booster, feature_names
+    except Exception as e:
+        st.error(f"模型加载失败: {e}")
+        return None, None
+
+
+@st.cache_resource
+def get_fallback_tree_explainer(path=MODEL_PATH):
+    # 回退路径使用的解释器只构建一次，树结构提取的开销每个进程只付一次
+    import shap
+    booster, _ = get_model(path)
+    # 不使用 FastTreeSHAP：其加载器按旧版二进制格式解析 booster.save_raw()，无法读取 xgboost>=2 的 UBJSON 模型
+    return shap.TreeExplainer(booster)
+
+
+@st.cache_resource
+def get_tree_predictor(path=MODEL_PATH):
+    # 树结构展开与 JIT 编译每个进程只做一次；numba 仅在此处导入
+    from utils.fast_predict import extract_tree_arrays, predict_one
+    booster, feature_names = get_model(path)
+    arrays = extract_tree_arrays(booster, feature_names)
+
+    def predict(x):
+        return predict_one(x, *arrays)
+
+    return predict
+
+
+@st.cache_resource
+def get_batch_booster(path=MODEL_PATH):
+    # 批量 SHAP 优先走 GPU (pred_contribs 自动使用 GPUTreeShap)，无可用 GPU 时退回 CPU
+    # 使用副本设置 device，单行 CPU 预测路径不受影响
+    import xgboost
+    booster, feature_names = get_model(path)
+    if not xgboost.build_info().get('USE_CUDA'):
+        return booster
+    gpu_booster = booster.copy()
+    try:
+        gpu_booster.set_param({'device': 'cuda'})
+        # 没有可见 GPU 时 XGBoost 只告警并回退到 CPU，需试探一次后读取实际生效的 device
+        probe = xgboost.DMatrix(np.zeros((1, len(feature_names)), dtype=np.float32), feature_names=feature_names)
+        gpu_booster.predict(probe, pred_contribs=True)
+        device = json.loads(gpu_booster.save_config())['learner']['generic_param'].get('device', 'cpu')
+    except xgboost.core.XGBoostError:
+        return booster
+    return gpu_booster if device.startswith('cuda') else booster